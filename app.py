@@ -1,63 +1,337 @@
+import atexit
+import json
+import logging
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from operator import itemgetter
 from pathlib import Path
-from datetime import datetime, timezone
 
+import pyarrow as pa
 import streamlit as st
 
 st.set_page_config(page_title="Jeopardy Buzzer", layout="centered")
 
+log = logging.getLogger(__name__)
+
 DB_PATH = Path(__file__).parent / "buzzer.db"
+BUSY_TIMEOUT_MS = 5000
+# The writer waits only briefly inside SQLite per attempt; begin_immediate's
+# backoff loop does the rest of the waiting, capped at BUSY_TIMEOUT_MS.
+WRITER_BUSY_TIMEOUT_MS = 10
+BUSY_BACKOFF_MAX_S = 0.05
+
+# Applied to every new connection. journal_mode=WAL is persistent in the DB
+# file, so it is only set on the writer connection.
+_CONN_PRAGMAS = f"""
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -64000;
+    PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};
+    PRAGMA foreign_keys = ON;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA journal_size_limit = 6144000;
+"""
+
+# SQLite allows a single writer, so there is one shared read-write
+# connection plus a small pool of read-only connections for page renders.
+READER_POOL_SIZE = 4
+
+# buzz_log rows are written off the buzz path by a background thread, up
+# to this many per transaction.
+LOG_BATCH_SIZE = 64
+
+# Hot-path SQL kept as module-level constants so every call hands sqlite3
+# the same string and hits its per-connection statement cache.
+_SQL_GET_ACTIVE = "SELECT id, winner_name FROM rounds WHERE is_active = 1 ORDER BY id DESC LIMIT 1"
+_SQL_CLAIM = """
+    UPDATE rounds SET winner_name = ?, winner_time_utc = ?
+    WHERE id = (SELECT id FROM rounds WHERE is_active = 1 ORDER BY id DESC LIMIT 1)
+      AND winner_name IS NULL
+    RETURNING id
+"""
+# reset_round starts a fresh round unless the active one is still unclaimed,
+# so repeated resets (double clicks, several admins) leave one open round.
+_SQL_CLOSE_CLAIMED_ROUND = "UPDATE rounds SET is_active = 0 WHERE is_active = 1 AND winner_name IS NOT NULL"
+_SQL_OPEN_ROUND_IF_NONE = (
+    "INSERT INTO rounds (is_active) SELECT 1 WHERE NOT EXISTS (SELECT 1 FROM rounds WHERE is_active = 1)"
+)
+_SQL_INSERT_ROUND = "INSERT INTO rounds (is_active, winner_name, winner_time_utc) VALUES (1, ?, ?)"
+# Builds the admin buzz-log table in one JSON document, already shaped and
+# formatted for display. Legacy rows stored ISO strings and pass through.
+# Aggregates don't guarantee the subquery's order, so 'id' is included for
+# the caller to sort on.
+_SQL_RECENT_BUZZES = """
+    SELECT json_group_array(json_object(
+        'id', id,
+        'round', round_id,
+        'player', player_name,
+        'time_utc', CASE WHEN buzz_time_utc GLOB '*[^0-9]*' THEN buzz_time_utc
+                         ELSE strftime('%Y-%m-%dT%H:%M:%f+00:00', buzz_time_utc / 1000.0, 'unixepoch') END,
+        'winner', CASE WHEN was_winner THEN '✅' ELSE '' END
+    ))
+    FROM (SELECT * FROM buzz_log ORDER BY id DESC LIMIT ?)
+"""
+_SQL_INSERT_LOG = "INSERT INTO buzz_log (round_id, player_name, buzz_time_utc, was_winner) VALUES (?, ?, ?, ?)"
 
 
 # -----------------------
 # DB helpers
 # -----------------------
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def _connect(read_only: bool = False):
+    if read_only:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False, cached_statements=256)
+    else:
+        # Autocommit: transactions are opened explicitly with BEGIN IMMEDIATE
+        # rather than by the sqlite3 module's implicit BEGIN.
+        conn = sqlite3.connect(
+            DB_PATH, check_same_thread=False, cached_statements=256, isolation_level=None
+        )
+        # page_size only takes effect on a fresh file, so it has to precede
+        # journal_mode, which writes the header; it is a no-op afterwards.
+        conn.execute("PRAGMA page_size = 8192")
+        conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(_CONN_PRAGMAS)
+    if not read_only:
+        conn.execute(f"PRAGMA busy_timeout = {WRITER_BUSY_TIMEOUT_MS}")
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def _close(conn):
+    try:
+        conn.execute("PRAGMA optimize")  # refresh planner stats before closing
+    except sqlite3.Error:
+        pass
+    conn.close()
+
+
+@st.cache_resource
+def _get_writer():
+    conn = _connect()
+    atexit.register(_close, conn)
+    return conn, threading.Lock()
+
+
+@st.cache_resource
+def _get_reader_pool():
+    # The semaphore caps borrowers at READER_POOL_SIZE, so at most that many
+    # reader connections are ever opened; further callers wait for one.
+    return queue.LifoQueue(), threading.BoundedSemaphore(READER_POOL_SIZE)
+
+
+@contextmanager
+def get_conn():
+    """Borrow a read-only connection from the pool."""
+    pool, slots = _get_reader_pool()
+    if not slots.acquire(timeout=BUSY_TIMEOUT_MS / 1000):
+        raise sqlite3.OperationalError("reader pool busy: no connection free")
+    try:
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = _connect(read_only=True)
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
+    finally:
+        slots.release()
+
+
+def _busy_deadline() -> float:
+    return time.monotonic() + BUSY_TIMEOUT_MS / 1000
+
+
+@contextmanager
+def get_write_conn(deadline: float | None = None):
+    """Hold the shared read-write connection for the duration of the block.
+
+    Waits for it until ``deadline`` (a time.monotonic() value, default
+    BUSY_TIMEOUT_MS from now), then raises a busy OperationalError.
+    """
+    if deadline is None:
+        deadline = _busy_deadline()
+    conn, lock = _get_writer()
+    if not lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+        raise sqlite3.OperationalError("database is busy: writer connection in use")
+    try:
+        yield conn
+    finally:
+        # Never hand the shared connection on with a transaction left open.
+        if conn.in_transaction:
+            conn.rollback()
+        lock.release()
+
+
+def _is_busy(e: sqlite3.OperationalError) -> bool:
+    msg = str(e)
+    return "locked" in msg or "busy" in msg
+
+
+def begin_immediate(conn, deadline: float | None = None):
+    """Open a write transaction, backing off and retrying on lock contention.
+
+    Gives up at ``deadline``; pass the one given to get_write_conn() so the
+    wait for the connection and for the SQLite lock share one budget. Only
+    BEGIN IMMEDIATE needs this: once it succeeds the write lock is held, so
+    the statements after it cannot hit SQLITE_BUSY.
+    """
+    if deadline is None:
+        deadline = _busy_deadline()
+    backoff = 0.001
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            remaining = deadline - time.monotonic()
+            if not _is_busy(e) or remaining <= 0:
+                raise
+            time.sleep(min(backoff, remaining))
+            backoff = min(backoff * 2, BUSY_BACKOFF_MAX_S)
+
+
 def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS rounds (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            is_active INTEGER NOT NULL DEFAULT 1,
-            winner_name TEXT,
-            winner_time_utc TEXT
-        )
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS buzz_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            round_id INTEGER NOT NULL,
-            player_name TEXT NOT NULL,
-            buzz_time_utc TEXT NOT NULL,
-            was_winner INTEGER NOT NULL DEFAULT 0,
-            FOREIGN KEY (round_id) REFERENCES rounds(id)
-        )
-    """)
+    deadline = _busy_deadline()
+    with get_write_conn(deadline) as conn:
+        begin_immediate(conn, deadline)
+        cur = conn.cursor()
 
-    cur.execute("SELECT id FROM rounds WHERE is_active = 1 ORDER BY id DESC LIMIT 1")
-    if cur.fetchone() is None:
-        cur.execute("INSERT INTO rounds (is_active) VALUES (1)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS rounds (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                is_active INTEGER NOT NULL DEFAULT 1,
+                winner_name TEXT,
+                winner_time_utc INTEGER
+            )
+        """)
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS buzz_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                round_id INTEGER NOT NULL,
+                player_name TEXT NOT NULL,
+                buzz_time_utc INTEGER NOT NULL,
+                was_winner INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (round_id) REFERENCES rounds(id)
+            )
+        """)
+
+        # Serves the active-round lookup done by every buzz and page render.
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_rounds_active ON rounds (is_active, id DESC)")
+
+        cur.execute("SELECT id FROM rounds WHERE is_active = 1 ORDER BY id DESC LIMIT 1")
+        if cur.fetchone() is None:
+            cur.execute("INSERT INTO rounds (is_active) VALUES (1)")
+
+        cur.execute("COMMIT")
 
-    conn.commit()
-    conn.close()
 
+@st.cache_resource
+def ensure_db():
+    """Run init_db() once per server process rather than on every rerun."""
+    init_db()
+    return True
 
-def get_active_round(conn):
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rounds WHERE is_active = 1 ORDER BY id DESC LIMIT 1")
-    return cur.fetchone()
 
+def _get_active_id_and_winner(conn):
+    return conn.execute(_SQL_GET_ACTIVE).fetchone()
 
-def utc_now_iso():
-    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+# Page renders poll these on every rerun; a short TTL collapses the reads
+# from all open sessions into one query per window.
+@st.cache_data(ttl=0.5)
+def _read_active_round():
+    with get_conn() as conn:
+        rnd = _get_active_id_and_winner(conn)
+    return dict(rnd) if rnd is not None else None
+
+
+@st.cache_data(ttl=0.5)
+def _read_recent_buzzes(limit: int = 50):
+    with get_conn() as conn:
+        (doc,) = conn.execute(_SQL_RECENT_BUZZES, (limit,)).fetchone()
+    rows = sorted(json.loads(doc), key=itemgetter("id"), reverse=True)
+    for r in rows:
+        del r["id"]
+    return rows
+
+
+# Timestamps are stored as integer milliseconds since the epoch and only
+# formatted when displayed (see _SQL_RECENT_BUZZES).
+_TIME_NS = time.time_ns  # bound once; skips the attribute lookup per buzz
+
+
+def _now_ms() -> int:
+    return _TIME_NS() // 1_000_000
+
+
+# -----------------------
+# Buzz log writer
+# -----------------------
+def _write_log_batch(items):
+    # The round claims these rows belong to are already committed, so lock
+    # contention is retried rather than losing them; other errors propagate.
+    while True:
+        try:
+            deadline = _busy_deadline()
+            with get_write_conn(deadline) as conn:
+                begin_immediate(conn, deadline)
+                conn.executemany(_SQL_INSERT_LOG, items)
+                conn.execute("COMMIT")
+            return
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            log.warning("Database busy, retrying %d buzz_log rows", len(items))
+
+
+def _drain_log_queue(q, stop):
+    while not (stop.is_set() and q.empty()):
+        try:
+            items = [q.get(timeout=0.1)]
+        except queue.Empty:
+            continue
+        while len(items) < LOG_BATCH_SIZE:
+            try:
+                items.append(q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write_log_batch(items)
+        except Exception:
+            # Keep the thread alive; a dead writer would hang flush_buzz_log().
+            log.exception("Dropped %d buzz_log rows", len(items))
+        finally:
+            for _ in items:
+                q.task_done()
+
+
+def _stop_log_writer(stop, thread):
+    stop.set()
+    thread.join(timeout=BUSY_TIMEOUT_MS / 1000)
+
+
+@st.cache_resource
+def _get_log_queue():
+    # Create the writer first so its atexit close runs after the final flush.
+    _get_writer()
+    q = queue.Queue()
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_drain_log_queue, args=(q, stop), name="buzz-log-writer", daemon=True
+    )
+    thread.start()
+    atexit.register(_stop_log_writer, stop, thread)
+    return q
+
+
+def flush_buzz_log():
+    """Block until every queued buzz_log row has been written."""
+    _get_log_queue().join()
 
 
 # -----------------------
@@ -68,51 +342,89 @@ def attempt_buzz(player_name: str) -> tuple[bool, str]:
     if not player_name:
         return False, "Enter your name first."
 
-    conn = get_conn()
-    cur = conn.cursor()
-
+    deadline = _busy_deadline()
     try:
-        cur.execute("BEGIN IMMEDIATE")  # lock for write
+        with get_write_conn(deadline) as conn:
+            begin_immediate(conn, deadline)  # lock for write
 
-        rnd = get_active_round(conn)
-        if rnd is None:
-            cur.execute("INSERT INTO rounds (is_active) VALUES (1)")
-            round_id = cur.lastrowid
-            winner_name = None
-        else:
-            round_id = rnd["id"]
-            winner_name = rnd["winner_name"]
-
-        buzz_time = utc_now_iso()
-
-        # Log attempt, capture row id
-        cur.execute(
-            "INSERT INTO buzz_log (round_id, player_name, buzz_time_utc, was_winner) VALUES (?, ?, ?, 0)",
-            (round_id, player_name, buzz_time),
-        )
-        log_id = cur.lastrowid
+            buzz_time = _now_ms()
 
-        if winner_name:
-            conn.commit()
-            return False, f"Too late - {winner_name} already buzzed first."
+            # Claim the active round if nobody has yet; RETURNING tells us
+            # whether this buzz won without a separate SELECT first.
+            claimed = conn.execute(_SQL_CLAIM, (player_name, buzz_time)).fetchone()
 
-        # Claim winner
-        cur.execute(
-            "UPDATE rounds SET winner_name = ?, winner_time_utc = ? WHERE id = ? AND winner_name IS NULL",
-            (player_name, buzz_time, round_id),
-        )
+            if claimed is not None:
+                round_id = claimed["id"]
+                winner_name = None
+            else:
+                rnd = _get_active_id_and_winner(conn)
+                if rnd is None:
+                    round_id = conn.execute(_SQL_INSERT_ROUND, (player_name, buzz_time)).lastrowid
+                    winner_name = None
+                else:
+                    round_id = rnd["id"]
+                    winner_name = rnd["winner_name"]
 
-        # Mark THIS log row as winner
-        cur.execute("UPDATE buzz_log SET was_winner = 1 WHERE id = ?", (log_id,))
+            conn.execute("COMMIT")
 
-        conn.commit()
-        return True, "You buzzed in FIRST!"
+            was_winner = winner_name is None
+            _get_log_queue().put((round_id, player_name, buzz_time, int(was_winner)))
 
     except sqlite3.Error as e:
-        try:
-            conn.rollback()
-        except Exception:
-            pass
+        # get_write_conn() has already rolled back anything left open.
+        if isinstance(e, sqlite3.OperationalError) and _is_busy(e):
+            return False, "Buzzer is busy - try again."
         return False, f"Database error: {e}"
-    finally:
-        conn.close()
+
+    if not was_winner:
+        return False, f"Too late - {winner_name} already buzzed first."
+    _read_active_round.clear()
+    return True, "You buzzed in FIRST!"
+
+
+def reset_round() -> tuple[bool, str]:
+    deadline = _busy_deadline()
+    try:
+        with get_write_conn(deadline) as conn:
+            begin_immediate(conn, deadline)
+            conn.execute(_SQL_CLOSE_CLAIMED_ROUND)
+            conn.execute(_SQL_OPEN_ROUND_IF_NONE)
+            conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        # get_write_conn() has already rolled back anything left open.
+        if isinstance(e, sqlite3.OperationalError) and _is_busy(e):
+            return False, "Database is busy - try again."
+        return False, f"Database error: {e}"
+    _read_active_round.clear()
+    return True, "Round reset."
+
+
+# -----------------------
+# UI
+# -----------------------
+REFRESH_MS = 750
+
+
+# Reruns on its own timer over the existing websocket, so polling the log no
+# longer needs a full-page meta refresh.
+@st.fragment(run_every=REFRESH_MS / 1000)
+def buzz_log_panel(limit: int = 50):
+    st.subheader("Buzz Log")
+    try:
+        rows = _read_recent_buzzes(limit)
+    except sqlite3.OperationalError as e:
+        if not _is_busy(e):
+            raise
+        # Reader pool exhausted for now; keep showing the last good table.
+        rows = st.session_state.get("buzz_log_rows")
+        st.caption("Buzz log is busy - showing the last update.")
+        if rows is None:
+            return
+    else:
+        st.session_state["buzz_log_rows"] = rows
+    if not rows:
+        st.caption("No buzzes yet.")
+        return
+    # An Arrow table is what Streamlit ships to the browser, so handing it one
+    # directly skips the list -> pandas -> Arrow conversion.
+    st.dataframe(pa.Table.from_pylist(rows), width="stretch", hide_index=True)
\ No newline at end of file